@@ -1,8 +1,11 @@
 import sqlite3
-from contextlib import closing
-from typing import Optional, List, Tuple
+import queue
+import threading
+from contextlib import closing, contextmanager
+from typing import Optional, List, Tuple, Dict, Iterator
 import streamlit as st
-import pyperclip
+from streamlit_sortables import sort_items
+import streamlit.components.v1 as components
 import json
 
 # -------------------------------
@@ -31,14 +34,58 @@ div[data-testid="stMainBlockContainer"] {padding: 2rem 1rem 1rem}
 # -------------------------------
 # DB Helpers (SQLite)
 # -------------------------------
-@st.cache_resource
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect("prompt_components.db", check_same_thread=False)
+DB_PATH = "prompt_components.db"
+POOL_SIZE = 4
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)  # INSERT ... RETURNING
+
+def _open_conn() -> sqlite3.Connection:
+    # Pooled connections move between Streamlit worker threads, hence check_same_thread=False.
+    # Helpers pass constant SQL text, so a larger statement cache keeps them all prepared
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA mmap_size = 268435456;
+        PRAGMA cache_size = -20000;
+        """
+    )
     conn.execute("PRAGMA foreign_keys = ON")
-    init_db(conn)
     return conn
 
+@st.cache_resource
+def get_conn_pool() -> "queue.Queue[sqlite3.Connection]":
+    pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=POOL_SIZE)
+    for i in range(POOL_SIZE):
+        conn = _open_conn()
+        if i == 0:
+            init_db(conn)
+        pool.put(conn)
+    return pool
+
+_borrowed = threading.local()
+
+@contextmanager
+def borrow_conn() -> Iterator[sqlite3.Connection]:
+    # Re-entrant per thread: nested borrows reuse the connection already held
+    held = getattr(_borrowed, "conn", None)
+    if held is not None:
+        yield held
+        return
+    pool = get_conn_pool()
+    conn = pool.get()
+    _borrowed.conn = conn
+    try:
+        yield conn
+    finally:
+        _borrowed.conn = None
+        # Never hand back a connection mid-transaction: it would keep holding the write lock
+        if conn.in_transaction:
+            conn.rollback()
+        pool.put(conn)
+
 def init_db(conn: sqlite3.Connection) -> None:
     conn.executescript(
         """
@@ -51,82 +98,181 @@ def init_db(conn: sqlite3.Connection) -> None:
             id INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
             content TEXT NOT NULL DEFAULT '',
-            folder_id INTEGER REFERENCES folders(id) ON DELETE SET NULL,
+            folder_id INTEGER REFERENCES folders(id) ON DELETE CASCADE,
             created_at TEXT NOT NULL DEFAULT (datetime('now')),
             updated_at TEXT NOT NULL DEFAULT (datetime('now'))
         );
-        CREATE INDEX IF NOT EXISTS idx_components_folder ON components(folder_id);
+        DROP INDEX IF EXISTS idx_components_folder;
+        CREATE INDEX IF NOT EXISTS idx_components_folder_name ON components(folder_id, name);
         CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_folder_name_per_parent ON folders(parent_id, name);
+
+        -- Closure table: one row per (ancestor, descendant) pair, including each folder with itself.
+        -- Read by delete_folder_recursive to find every component under a folder in one lookup
+        CREATE TABLE IF NOT EXISTS folder_closure (
+            ancestor INTEGER NOT NULL,
+            descendant INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor, descendant)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_closure_desc ON folder_closure(descendant);
+        CREATE TRIGGER IF NOT EXISTS trg_folder_closure_insert AFTER INSERT ON folders
+        BEGIN
+            INSERT INTO folder_closure (ancestor, descendant, depth)
+                SELECT ancestor, NEW.id, depth + 1 FROM folder_closure WHERE descendant = NEW.parent_id
+                UNION ALL
+                SELECT NEW.id, NEW.id, 0;
+        END;
+        -- Also fires for rows removed by ON DELETE CASCADE
+        CREATE TRIGGER IF NOT EXISTS trg_folder_closure_delete AFTER DELETE ON folders
+        BEGIN
+            DELETE FROM folder_closure WHERE descendant = OLD.id OR ancestor = OLD.id;
+        END;
+        -- Re-parenting: detach the subtree from its old ancestors, then link it under the new ones
+        CREATE TRIGGER IF NOT EXISTS trg_folder_closure_move AFTER UPDATE OF parent_id ON folders
+        WHEN OLD.parent_id IS NOT NEW.parent_id
+        BEGIN
+            DELETE FROM folder_closure
+            WHERE descendant IN (SELECT descendant FROM folder_closure WHERE ancestor = OLD.id)
+              AND ancestor NOT IN (SELECT descendant FROM folder_closure WHERE ancestor = OLD.id);
+            INSERT INTO folder_closure (ancestor, descendant, depth)
+                SELECT up.ancestor, sub.descendant, up.depth + sub.depth + 1
+                FROM folder_closure up CROSS JOIN folder_closure sub
+                WHERE up.descendant = NEW.parent_id AND sub.ancestor = NEW.id;
+        END;
         """
     )
-    conn.execute("INSERT OR IGNORE INTO folders (name, parent_id) VALUES ('home', NULL)")
-    home_id = conn.execute("SELECT id FROM folders WHERE parent_id IS NULL AND name='home'").fetchone()[0]
-    conn.execute("UPDATE components SET folder_id = ? WHERE folder_id IS NULL", (home_id,))
+    _migrate_components_fk_cascade(conn)
+    if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM folder_closure) AND EXISTS (SELECT 1 FROM folders)").fetchone()[0]:
+        rebuild_folder_closure(conn)
+    # Only write when something is missing. INSERT OR IGNORE could not be relied on here:
+    # the unique (parent_id, name) index treats NULL parents as distinct, so it added a new
+    # 'home' row on every call.
+    row = conn.execute("SELECT id FROM folders WHERE parent_id IS NULL AND name='home' ORDER BY id LIMIT 1").fetchone()
+    if row is None:
+        home_id = conn.execute("INSERT INTO folders (name, parent_id) VALUES ('home', NULL)").lastrowid
+    else:
+        home_id = row[0]
+    if conn.execute("SELECT 1 FROM components WHERE folder_id IS NULL LIMIT 1").fetchone():
+        conn.execute("UPDATE components SET folder_id = ? WHERE folder_id IS NULL", (home_id,))
     conn.commit()
 
+def _migrate_components_fk_cascade(conn: sqlite3.Connection) -> None:
+    # Databases created before components.folder_id cascaded still have ON DELETE SET NULL.
+    # SQLite cannot alter a foreign key in place, so rebuild the table once.
+    fks = conn.execute("PRAGMA foreign_key_list(components)").fetchall()
+    if not any(fk["table"] == "folders" and fk["on_delete"] == "SET NULL" for fk in fks):
+        return
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.executescript(
+            """
+            BEGIN;
+            CREATE TABLE components_new (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                content TEXT NOT NULL DEFAULT '',
+                folder_id INTEGER REFERENCES folders(id) ON DELETE CASCADE,
+                created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+            );
+            INSERT INTO components_new (id, name, content, folder_id, created_at, updated_at)
+                SELECT id, name, content, folder_id, created_at, updated_at FROM components;
+            DROP TABLE components;
+            ALTER TABLE components_new RENAME TO components;
+            CREATE INDEX idx_components_folder_name ON components(folder_id, name);
+            COMMIT;
+            """
+        )
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+def rebuild_folder_closure(conn: sqlite3.Connection) -> None:
+    # Needed when folders were written without the triggers seeing parents first
+    # (databases created before the closure table, bulk imports in arbitrary order)
+    conn.execute("DELETE FROM folder_closure")
+    conn.execute(
+        """
+        INSERT INTO folder_closure (ancestor, descendant, depth)
+        WITH RECURSIVE c(ancestor, descendant, depth) AS (
+            SELECT id, id, 0 FROM folders
+            UNION ALL
+            SELECT c.ancestor, f.id, c.depth + 1 FROM folders f JOIN c ON f.parent_id = c.descendant
+        )
+        SELECT ancestor, descendant, depth FROM c
+        """
+    )
+
+@contextmanager
+def tx(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # One explicit transaction (and one commit) around several writes
+    conn.execute("BEGIN")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
 def exec_commit(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> None:
-    with closing(conn.cursor()) as cur:
-        cur.execute(sql, params)
-    conn.commit()
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
 
 def query_all(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
-    with closing(conn.cursor()) as cur:
-        cur.execute(sql, params)
-        return cur.fetchall()
+    return conn.execute(sql, params).fetchall()
 
 def query_one(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
-    with closing(conn.cursor()) as cur:
-        cur.execute(sql, params)
-        return cur.fetchone()
+    return conn.execute(sql, params).fetchone()
+
+def query_tuples(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> List[tuple]:
+    # Plain tuples for hot read paths: skips building a sqlite3.Row per result row
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur.execute(sql, params).fetchall()
+
+@st.cache_resource
+def _folders_rev() -> dict:
+    # Shared by every session since they all read the same database file
+    return {"rev": 0}
+
+def bump_folders_rev() -> None:
+    _folders_rev()["rev"] += 1
 
-def get_home_folder_id(conn: sqlite3.Connection) -> int:
-    row = query_one(conn, "SELECT id FROM folders WHERE parent_id IS NULL AND name='home'")
+@st.cache_resource
+def _components_rev() -> dict:
+    # Bumped by every component write, same as _folders_rev for folders
+    return {"rev": 0}
+
+def bump_components_rev() -> None:
+    _components_rev()["rev"] += 1
+
+@st.cache_resource
+def get_home_folder_id(_conn: sqlite3.Connection) -> int:
+    row = query_one(_conn, "SELECT id FROM folders WHERE parent_id IS NULL AND name='home'")
     if not row:
-        exec_commit(conn, "INSERT INTO folders (name, parent_id) VALUES ('home', NULL)")
-        row = query_one(conn, "SELECT id FROM folders WHERE parent_id IS NULL AND name='home'")
+        exec_commit(_conn, "INSERT INTO folders (name, parent_id) VALUES ('home', NULL)")
+        row = query_one(_conn, "SELECT id FROM folders WHERE parent_id IS NULL AND name='home'")
     return row["id"]
 
-def list_folders_by_parent(conn: sqlite3.Connection, parent_id: Optional[int]) -> List[sqlite3.Row]:
-    if parent_id is None:
-        return query_all(conn, "SELECT * FROM folders WHERE parent_id IS NULL ORDER BY name")
-    return query_all(conn, "SELECT * FROM folders WHERE parent_id = ? ORDER BY name", (parent_id,))
-
 def create_folder(conn: sqlite3.Connection, name: str, parent_id: Optional[int]) -> int:
-    with closing(conn.cursor()) as cur:
-        if parent_id is None:
-            cur.execute("INSERT INTO folders (name, parent_id) VALUES (?, NULL)", (name,))
+    try:
+        if HAS_RETURNING:
+            new_id = conn.execute("INSERT INTO folders (name, parent_id) VALUES (?, ?) RETURNING id", (name, parent_id)).fetchone()[0]
         else:
-            cur.execute("INSERT INTO folders (name, parent_id) VALUES (?, ?)", (name, parent_id))
+            new_id = conn.execute("INSERT INTO folders (name, parent_id) VALUES (?, ?)", (name, parent_id)).lastrowid
         conn.commit()
-        return cur.lastrowid
+    except BaseException:
+        conn.rollback()
+        raise
+    bump_folders_rev()
+    return new_id
 
 def rename_folder(conn: sqlite3.Connection, folder_id: int, new_name: str) -> None:
     exec_commit(conn, "UPDATE folders SET name = ? WHERE id = ?", (new_name, folder_id))
-
-def delete_folder(conn: sqlite3.Connection, folder_id: int) -> bool:
-    children = list_folders_by_parent(conn, folder_id)
-    comps = list_components_by_folder(conn, folder_id)
-    if children or comps:
-        return False
-    exec_commit(conn, "DELETE FROM folders WHERE id = ?", (folder_id,))
-    return True
-
-def get_descendant_folder_ids(conn: sqlite3.Connection, folder_id: int) -> list[int]:
-    ids = [folder_id]
-    stack = [folder_id]
-    while stack:
-        pid = stack.pop()
-        for row in list_folders_by_parent(conn, pid):
-            ids.append(row["id"])
-            stack.append(row["id"])
-    return ids
-
-def get_component_ids_in_folders(conn: sqlite3.Connection, folder_ids: list[int]) -> list[int]:
-    if not folder_ids:
-        return []
-    placeholders = ",".join("?" * len(folder_ids))
-    rows = query_all(conn, f"SELECT id FROM components WHERE folder_id IN ({placeholders})", tuple(folder_ids))
-    return [r["id"] for r in rows]
+    bump_folders_rev()
 
 def delete_folder_recursive(conn: sqlite3.Connection, folder_id: int) -> tuple[bool, str | None]:
     try:
@@ -135,86 +281,182 @@ def delete_folder_recursive(conn: sqlite3.Connection, folder_id: int) -> tuple[b
     except Exception:
         pass
 
-    folder_ids = get_descendant_folder_ids(conn, folder_id)
-    comp_ids = get_component_ids_in_folders(conn, folder_ids)
+    # Component ids are only needed for the session-state cleanup below
+    rows = query_all(
+        conn,
+        "SELECT id FROM components WHERE folder_id IN (SELECT descendant FROM folder_closure WHERE ancestor = ?)",
+        (folder_id,),
+    )
+    comp_ids = [r["id"] for r in rows]
+
+    # Subfolders and their components are removed by ON DELETE CASCADE
+    with tx(conn):
+        conn.execute("DELETE FROM folders WHERE id = ?", (folder_id,))
+    bump_folders_rev()
+    bump_components_rev()
+
     if comp_ids:
-        placeholders = ",".join("?" * len(comp_ids))
-        exec_commit(conn, f"DELETE FROM components WHERE id IN ({placeholders})", tuple(comp_ids))
         if st.session_state.get("selected_component_id") in comp_ids:
             st.session_state.selected_component_id = None
         comp_id_set = set(comp_ids)
         st.session_state.builder_list = [cid for cid in st.session_state.builder_list if cid not in comp_id_set]
-
-    exec_commit(conn, "DELETE FROM folders WHERE id = ?", (folder_id,))
     return True, None
 
-def list_components_by_folder(conn: sqlite3.Connection, folder_id: Optional[int]) -> List[sqlite3.Row]:
-    if folder_id is None:
-        return query_all(conn, "SELECT * FROM components WHERE folder_id IS NULL ORDER BY name")
-    return query_all(conn, "SELECT * FROM components WHERE folder_id = ? ORDER BY name", (folder_id,))
+def _tree_version() -> str:
+    # Changes on any folder mutation or component create/edit/move/delete
+    return f"{_folders_rev()['rev']}|{_components_rev()['rev']}"
+
+# The counters only see writes made by this process; the ttl bounds how long edits from
+# outside it (another app process, a tool writing the database file) go unnoticed
+@st.cache_data(ttl=30, show_spinner=False, max_entries=8)
+def _tree_snapshot(_conn: sqlite3.Connection, token: str) -> Tuple[Dict[Optional[int], List[dict]], Dict[int, List[dict]]]:
+    # Two queries for the whole tree; rows stay name-ordered within each bucket
+    folders_by_parent: Dict[Optional[int], List[dict]] = {}
+    for fid, name, parent_id in query_tuples(_conn, "SELECT id, name, parent_id FROM folders ORDER BY parent_id, name"):
+        folders_by_parent.setdefault(parent_id, []).append({"id": fid, "name": name, "parent_id": parent_id})
+    comps_by_folder: Dict[int, List[dict]] = {}
+    for cid, name, folder_id in query_tuples(_conn, "SELECT id, name, folder_id FROM components ORDER BY folder_id, name"):
+        comps_by_folder.setdefault(folder_id, []).append({"id": cid, "name": name, "folder_id": folder_id})
+    return folders_by_parent, comps_by_folder
+
+def load_folder_tree(conn: sqlite3.Connection) -> Tuple[Dict[Optional[int], List[dict]], Dict[int, List[dict]]]:
+    return _tree_snapshot(conn, _tree_version())
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_component(_conn: sqlite3.Connection, component_id: int, rev: int) -> Optional[dict]:
+    # `rev` is _components_rev, so a new key is used after each component write
+    row = query_one(
+        _conn, "SELECT id, name, content, folder_id, updated_at FROM components WHERE id = ?", (component_id,)
+    )
+    return dict(row) if row else None
+
+def get_component_cached(conn: sqlite3.Connection, component_id: int) -> Optional[dict]:
+    return _cached_component(conn, component_id, _components_rev()["rev"])
+
+def get_components_by_ids(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, sqlite3.Row]:
+    if not ids:
+        return {}
+    # json_each keeps the SQL text identical for any number of ids so it stays in the statement cache
+    rows = query_all(
+        conn,
+        "SELECT id, name, folder_id FROM components WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ids),),
+    )
+    return {r["id"]: r for r in rows}
+
+def get_component_contents(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, str]:
+    # Content is only read here and in _cached_component; list queries leave it out
+    if not ids:
+        return {}
+    rows = query_tuples(
+        conn,
+        "SELECT id, content FROM components WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ids),),
+    )
+    return dict(rows)
 
-def get_component(conn: sqlite3.Connection, component_id: int) -> Optional[sqlite3.Row]:
-    return query_one(conn, "SELECT * FROM components WHERE id = ?", (component_id,))
+@st.cache_data(ttl=300, show_spinner=False, max_entries=64)
+def _assemble_components(_conn: sqlite3.Connection, ids: Tuple[int, ...], rev: int) -> str:
+    # `rev` is _components_rev, so any component write changes the key
+    content_by_id = get_component_contents(_conn, list(ids))
+    return "\n\n".join(content_by_id[cid] for cid in ids if cid in content_by_id)
 
 def create_component(conn: sqlite3.Connection, name: str, folder_id: Optional[int]) -> int:
     if folder_id is None:
         folder_id = get_home_folder_id(conn)
-    with closing(conn.cursor()) as cur:
-        cur.execute("INSERT INTO components (name, content, folder_id) VALUES (?, '', ?)", (name, folder_id))
+    try:
+        if HAS_RETURNING:
+            new_id = conn.execute(
+                "INSERT INTO components (name, content, folder_id) VALUES (?, '', ?) RETURNING id", (name, folder_id)
+            ).fetchone()[0]
+        else:
+            new_id = conn.execute("INSERT INTO components (name, content, folder_id) VALUES (?, '', ?)", (name, folder_id)).lastrowid
         conn.commit()
-        return cur.lastrowid
+    except BaseException:
+        conn.rollback()
+        raise
+    bump_components_rev()
+    return new_id
 
 def rename_component(conn: sqlite3.Connection, component_id: int, new_name: str) -> None:
     exec_commit(conn, "UPDATE components SET name = ?, updated_at = datetime('now') WHERE id = ?", (new_name, component_id))
-
-def update_component_content(conn: sqlite3.Connection, component_id: int, new_content: str) -> None:
-    exec_commit(conn, "UPDATE components SET content = ?, updated_at = datetime('now') WHERE id = ?", (new_content, component_id))
+    bump_components_rev()
 
 def move_component(conn: sqlite3.Connection, component_id: int, new_folder_id: Optional[int]) -> None:
     if new_folder_id is None:
         new_folder_id = get_home_folder_id(conn)
     exec_commit(conn, "UPDATE components SET folder_id = ?, updated_at = datetime('now') WHERE id = ?", (new_folder_id, component_id))
+    bump_components_rev()
+
+def update_component(
+    conn: sqlite3.Connection,
+    component_id: int,
+    name: Optional[str] = None,
+    folder_id: Optional[int] = None,
+    content: Optional[str] = None,
+) -> None:
+    # Only the given columns are written, all in one statement and one commit
+    sets: List[str] = []
+    params: list = []
+    if name is not None:
+        sets.append("name = ?")
+        params.append(name)
+    if folder_id is not None:
+        sets.append("folder_id = ?")
+        params.append(folder_id)
+    if content is not None:
+        sets.append("content = ?")
+        params.append(content)
+    if not sets:
+        return
+    sets.append("updated_at = datetime('now')")
+    with tx(conn):
+        conn.execute(f"UPDATE components SET {', '.join(sets)} WHERE id = ?", (*params, component_id))
+    bump_components_rev()
 
 def delete_component(conn: sqlite3.Connection, component_id: int) -> None:
     exec_commit(conn, "DELETE FROM components WHERE id = ?", (component_id,))
+    bump_components_rev()
 
 def get_folder(conn: sqlite3.Connection, folder_id: int) -> Optional[sqlite3.Row]:
     return query_one(conn, "SELECT * FROM folders WHERE id = ?", (folder_id,))
 
-def build_folder_path(conn: sqlite3.Connection, folder_id: Optional[int]) -> str:
-    home_id = get_home_folder_id(conn)
-    if folder_id is None or folder_id == home_id:
-        return "home"
-    names = []
-    current = get_folder(conn, folder_id)
-    while current is not None and not (current["parent_id"] is None and current["name"] == "home"):
-        names.append(current["name"])
-        current = get_folder(conn, current["parent_id"]) if current["parent_id"] else None
-    return "home / " + " / ".join(reversed(names))
+def folder_paths_from_tree(folders_by_parent: Dict[Optional[int], List[dict]], home_id: int) -> Dict[int, str]:
+    # Breadth-first from home over the already-loaded buckets; no SQL
+    path_by_id = {home_id: "home"}
+    pending = [home_id]
+    for fid in pending:
+        for child in folders_by_parent.get(fid, []):
+            path_by_id[child["id"]] = path_by_id[fid] + " / " + child["name"]
+            pending.append(child["id"])
+    return path_by_id
 
 def all_folders_with_paths(conn: sqlite3.Connection) -> List[Tuple[int, str]]:
-    home_id = get_home_folder_id(conn)
-    results: List[Tuple[int, str]] = [(home_id, "home")]
-    def dfs(parent_id: int, prefix: str):
-        for f in list_folders_by_parent(conn, parent_id):
-            path = prefix + " / " + f["name"]
-            results.append((f["id"], path))
-            dfs(f["id"], path)
-    dfs(home_id, "home")
-    return results
+    # Paths come from the cached tree snapshot, so the dialogs issue no SQL of their own
+    folders_by_parent, _ = load_folder_tree(conn)
+    path_by_id = folder_paths_from_tree(folders_by_parent, get_home_folder_id(conn))
+    return sorted(path_by_id.items(), key=lambda item: item[1])
 
 def export_db_to_json(conn: sqlite3.Connection) -> str:
-    folders = query_all(conn, "SELECT id, name, parent_id FROM folders ORDER BY id")
-    components = query_all(conn, """
-        SELECT id, name, content, folder_id, created_at, updated_at
-        FROM components ORDER BY id
-    """)
-    payload = {
-        "schema": "prompt_builder_sqlite_v1",
-        "folders": [dict(r) for r in folders],
-        "components": [dict(r) for r in components],
-    }
-    return json.dumps(payload, indent=2, ensure_ascii=False)
+    # SQLite serializes the rows itself; only the small envelope is assembled in Python
+    folders_json = query_one(
+        conn,
+        """
+        SELECT json_group_array(json_object('id', id, 'name', name, 'parent_id', parent_id))
+        FROM (SELECT id, name, parent_id FROM folders ORDER BY id)
+        """,
+    )[0]
+    components_json = query_one(
+        conn,
+        """
+        SELECT json_group_array(json_object(
+            'id', id, 'name', name, 'content', content, 'folder_id', folder_id,
+            'created_at', created_at, 'updated_at', updated_at
+        ))
+        FROM (SELECT id, name, content, folder_id, created_at, updated_at FROM components ORDER BY id)
+        """,
+    )[0]
+    return '{"schema": "prompt_builder_sqlite_v1", "folders": ' + folders_json + ', "components": ' + components_json + "}"
 
 def import_db_from_json(conn: sqlite3.Connection, json_text: str) -> None:
     payload = json.loads(json_text)
@@ -224,25 +466,27 @@ def import_db_from_json(conn: sqlite3.Connection, json_text: str) -> None:
     folders = payload.get("folders", [])
     components = payload.get("components", [])
 
-    # Import in a transaction; disable FK to insert in any order (IDs preserved)
-    with closing(conn.cursor()) as cur:
-        cur.execute("BEGIN")
-        try:
-            cur.execute("PRAGMA foreign_keys = OFF")
+    # Import in a transaction; disable FK to insert in any order (IDs preserved).
+    # The pragma is a no-op inside a transaction, so it is toggled around it.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with tx(conn), closing(conn.cursor()) as cur:
             cur.execute("DELETE FROM components")
             cur.execute("DELETE FROM folders")
-
-            for f in folders:
-                cur.execute(
-                    "INSERT INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
-                    (f.get("id"), f.get("name"), f.get("parent_id")),
-                )
-
-            for c in components:
-                cur.execute(
-                    """INSERT INTO components
-                       (id, name, content, folder_id, created_at, updated_at)
-                       VALUES (?, ?, ?, ?, ?, ?)""",
+            # Rebuild indexes once after the bulk insert instead of maintaining them per row
+            cur.execute("DROP INDEX IF EXISTS idx_unique_folder_name_per_parent")
+            cur.execute("DROP INDEX IF EXISTS idx_components_folder_name")
+
+            cur.executemany(
+                "INSERT INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+                [(f.get("id"), f.get("name"), f.get("parent_id")) for f in folders],
+            )
+
+            cur.executemany(
+                """INSERT INTO components
+                   (id, name, content, folder_id, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [
                     (
                         c.get("id"),
                         c.get("name"),
@@ -250,283 +494,370 @@ def import_db_from_json(conn: sqlite3.Connection, json_text: str) -> None:
                         c.get("folder_id"),
                         c.get("created_at"),
                         c.get("updated_at"),
-                    ),
-                )
+                    )
+                    for c in components
+                ],
+            )
 
-            cur.execute("COMMIT")
-        except Exception:
-            cur.execute("ROLLBACK")
-            raise
-        finally:
-            cur.execute("PRAGMA foreign_keys = ON")
+            cur.execute("CREATE UNIQUE INDEX idx_unique_folder_name_per_parent ON folders(parent_id, name)")
+            cur.execute("CREATE INDEX idx_components_folder_name ON components(folder_id, name)")
+            rebuild_folder_closure(conn)
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
 
     # Ensure 'home' exists and rootless components are moved there (aligns with app expectations)
     init_db(conn)
+    get_home_folder_id.clear()
+    _assemble_components.clear()
+    _cached_component.clear()
+    bump_folders_rev()
+    bump_components_rev()
 
 # -------------------------------
 # Session State
 # -------------------------------
+MAX_BUILDER_ITEMS = 200  # oldest entries are dropped once the builder grows past this
+
 if "builder_list" not in st.session_state:
     st.session_state.builder_list = []  # component ids in order
 if "free_text" not in st.session_state:
     st.session_state.free_text = ""
 if "pp_epoch" not in st.session_state:
     st.session_state.pp_epoch = 0
+if "expanded_folders" not in st.session_state:
+    st.session_state.expanded_folders = set()  # folder ids whose contents are rendered
+if "_open_dialogs" not in st.session_state:
+    st.session_state._open_dialogs = set()  # flag keys of dialogs currently open
 
 # -------------------------------
 # Dialog Helpers
 # -------------------------------
+def _set_dialog_open(flag_key: str, is_open: bool):
+    # Mirror every dialog flag into one set so renderers can skip closed dialogs cheaply
+    st.session_state[flag_key] = is_open
+    if is_open:
+        st.session_state._open_dialogs.add(flag_key)
+    else:
+        st.session_state._open_dialogs.discard(flag_key)
+
 def _close(flag_key: str):
-    st.session_state[flag_key] = False
+    _set_dialog_open(flag_key, False)
     st.session_state["pp_epoch"] = st.session_state.get("pp_epoch", 0) + 1
     st.rerun()
 
 def _open_dialog(flag_key: str):
     # Open a dialog and force the popover to close on this run
-    st.session_state[flag_key] = True
+    _set_dialog_open(flag_key, True)
     st.session_state["pp_epoch"] = st.session_state.get("pp_epoch", 0) + 1
     st.rerun()
 
+# Dialog bodies rerun as fragments after the page-level borrow has been returned, so each
+# _dlg borrows its own connection instead of capturing the one from the run that opened it.
+
 def _pp_label(base: str = "…") -> str:
     epoch = st.session_state.get("pp_epoch", 0)
     return base + ("\u200b" * (epoch % 7))
 
-def show_new_folder_dialog(conn, parent_id: int):
+def show_new_folder_dialog(parent_id: int):
     flag = f"dlg_new_folder_{parent_id}"
     if st.session_state.get(flag):
         @st.dialog("New folder")
         def _dlg():
-            with st.form(f"form_new_folder_{parent_id}"):
-                name = st.text_input("Subfolder name")
-                c1, c2 = st.columns(2)
-                create = c1.form_submit_button("Create", type="primary", use_container_width=True)
-                cancel = c2.form_submit_button("Cancel", use_container_width=True)
-                if create:
-                    if name.strip():
-                        create_folder(conn, name.strip(), parent_id)
+            with borrow_conn() as conn:
+                with st.form(f"form_new_folder_{parent_id}"):
+                    name = st.text_input("Subfolder name")
+                    c1, c2 = st.columns(2)
+                    create = c1.form_submit_button("Create", type="primary", use_container_width=True)
+                    cancel = c2.form_submit_button("Cancel", use_container_width=True)
+                    if create:
+                        if name.strip():
+                            create_folder(conn, name.strip(), parent_id)
+                            _close(flag)
+                        else:
+                            st.warning("Name cannot be empty.")
+                    elif cancel:
                         _close(flag)
-                    else:
-                        st.warning("Name cannot be empty.")
-                elif cancel:
-                    _close(flag)
         _dlg()
 
-def show_new_component_dialog(conn, folder_id: int):
+def show_new_component_dialog(folder_id: int):
     flag = f"dlg_new_comp_{folder_id}"
     if st.session_state.get(flag):
         @st.dialog("New component")
         def _dlg():
-            with st.form(f"form_new_comp_{folder_id}"):
-                name = st.text_input("Component name")
-                c1, c2 = st.columns(2)
-                create = c1.form_submit_button("Create", type="primary", use_container_width=True)
-                cancel = c2.form_submit_button("Cancel", use_container_width=True)
-                if create:
-                    if name.strip():
-                        create_component(conn, name.strip(), folder_id)
+            with borrow_conn() as conn:
+                with st.form(f"form_new_comp_{folder_id}"):
+                    name = st.text_input("Component name")
+                    c1, c2 = st.columns(2)
+                    create = c1.form_submit_button("Create", type="primary", use_container_width=True)
+                    cancel = c2.form_submit_button("Cancel", use_container_width=True)
+                    if create:
+                        if name.strip():
+                            create_component(conn, name.strip(), folder_id)
+                            _close(flag)
+                        else:
+                            st.warning("Name cannot be empty.")
+                    elif cancel:
                         _close(flag)
-                    else:
-                        st.warning("Name cannot be empty.")
-                elif cancel:
-                    _close(flag)
         _dlg()
 
-def show_rename_folder_dialog(conn, folder_id: int, current_name: str):
+def show_rename_folder_dialog(folder_id: int, current_name: str):
     flag = f"dlg_rename_folder_{folder_id}"
     if st.session_state.get(flag):
         @st.dialog("Rename folder")
         def _dlg():
-            with st.form(f"form_rename_folder_{folder_id}"):
-                new_name = st.text_input("Folder name", value=current_name)
-                c1, c2 = st.columns(2)
-                save = c1.form_submit_button("Save", type="primary", use_container_width=True)
-                cancel = c2.form_submit_button("Cancel", use_container_width=True)
-                if save:
-                    if new_name.strip():
-                        rename_folder(conn, folder_id, new_name.strip())
+            with borrow_conn() as conn:
+                with st.form(f"form_rename_folder_{folder_id}"):
+                    new_name = st.text_input("Folder name", value=current_name)
+                    c1, c2 = st.columns(2)
+                    save = c1.form_submit_button("Save", type="primary", use_container_width=True)
+                    cancel = c2.form_submit_button("Cancel", use_container_width=True)
+                    if save:
+                        if new_name.strip():
+                            rename_folder(conn, folder_id, new_name.strip())
+                            _close(flag)
+                        else:
+                            st.warning("Name cannot be empty.")
+                    elif cancel:
                         _close(flag)
-                    else:
-                        st.warning("Name cannot be empty.")
-                elif cancel:
-                    _close(flag)
         _dlg()
 
-def show_delete_folder_dialog(conn: sqlite3.Connection, folder_id: int, folder_name: str):
+def show_delete_folder_dialog(folder_id: int, folder_name: str):
     flag = f"dlg_del_folder_{folder_id}"
     if st.session_state.get(flag):
         @st.dialog(f"Delete folder: {folder_name}")
         def _dlg():
-            st.error("This will permanently delete this folder, all subfolders, and all components within them.", icon="⚠️")
-            c1, c2 = st.columns(2)
-            do_delete = c1.button("Delete", type="primary", use_container_width=True, key=f"df_all_{folder_id}")
-            cancel = c2.button("Cancel", use_container_width=True, key=f"df_cancel_{folder_id}")
-            if do_delete:
-                ok, msg = delete_folder_recursive(conn, folder_id)
-                if not ok and msg:
-                    st.error(msg)
-                st.session_state[flag] = False
-                st.rerun()
-            elif cancel:
-                st.session_state[flag] = False
-                st.rerun()
+            with borrow_conn() as conn:
+                st.error("This will permanently delete this folder, all subfolders, and all components within them.", icon="⚠️")
+                c1, c2 = st.columns(2)
+                do_delete = c1.button("Delete", type="primary", use_container_width=True, key=f"df_all_{folder_id}")
+                cancel = c2.button("Cancel", use_container_width=True, key=f"df_cancel_{folder_id}")
+                if do_delete:
+                    ok, msg = delete_folder_recursive(conn, folder_id)
+                    if not ok and msg:
+                        st.error(msg)
+                    _set_dialog_open(flag, False)
+                    st.rerun()
+                elif cancel:
+                    _set_dialog_open(flag, False)
+                    st.rerun()
         _dlg()
 
-def show_rename_component_dialog(conn, comp_id: int, current_name: str):
+def show_rename_component_dialog(comp_id: int, current_name: str):
     flag = f"dlg_rename_comp_{comp_id}"
     if st.session_state.get(flag):
         @st.dialog("Rename component")
         def _dlg():
-            with st.form(f"form_rename_comp_{comp_id}"):
-                new_name = st.text_input("Component name", value=current_name)
-                c1, c2 = st.columns(2)
-                save = c1.form_submit_button("Save", type="primary", use_container_width=True)
-                cancel = c2.form_submit_button("Cancel", use_container_width=True)
-                if save:
-                    if new_name.strip():
-                        rename_component(conn, comp_id, new_name.strip())
+            with borrow_conn() as conn:
+                with st.form(f"form_rename_comp_{comp_id}"):
+                    new_name = st.text_input("Component name", value=current_name)
+                    c1, c2 = st.columns(2)
+                    save = c1.form_submit_button("Save", type="primary", use_container_width=True)
+                    cancel = c2.form_submit_button("Cancel", use_container_width=True)
+                    if save:
+                        if new_name.strip():
+                            rename_component(conn, comp_id, new_name.strip())
+                            _close(flag)
+                        else:
+                            st.warning("Name cannot be empty.")
+                    elif cancel:
                         _close(flag)
-                    else:
-                        st.warning("Name cannot be empty.")
-                elif cancel:
-                    _close(flag)
         _dlg()
 
-def show_move_component_dialog(conn, comp_id: int, current_folder_id: Optional[int]):
+def show_move_component_dialog(comp_id: int, current_folder_id: Optional[int]):
     flag = f"dlg_move_comp_{comp_id}"
     if st.session_state.get(flag):
         @st.dialog("Move component")
         def _dlg():
-            options = all_folders_with_paths(conn)
-            idx = 0
-            current_id = current_folder_id if current_folder_id is not None else get_home_folder_id(conn)
-            for i, (fid, _) in enumerate(options):
-                if fid == current_id:
-                    idx = i
-                    break
-            sel = st.selectbox("Destination folder", options=options, index=idx, format_func=lambda x: x[1], key=f"mv_sel_{comp_id}")
-            c1, c2 = st.columns(2)
-            move_btn = c1.button("Move", type="primary", use_container_width=True, key=f"mv_btn_{comp_id}")
-            cancel = c2.button("Cancel", use_container_width=True, key=f"mv_cancel_{comp_id}")
-            if move_btn:
-                move_component(conn, comp_id, sel[0])
-                _close(flag)
-            elif cancel:
-                _close(flag)
+            with borrow_conn() as conn:
+                options = all_folders_with_paths(conn)
+                idx = 0
+                current_id = current_folder_id if current_folder_id is not None else get_home_folder_id(conn)
+                for i, (fid, _) in enumerate(options):
+                    if fid == current_id:
+                        idx = i
+                        break
+                sel = st.selectbox("Destination folder", options=options, index=idx, format_func=lambda x: x[1], key=f"mv_sel_{comp_id}")
+                c1, c2 = st.columns(2)
+                move_btn = c1.button("Move", type="primary", use_container_width=True, key=f"mv_btn_{comp_id}")
+                cancel = c2.button("Cancel", use_container_width=True, key=f"mv_cancel_{comp_id}")
+                if move_btn:
+                    move_component(conn, comp_id, sel[0])
+                    _close(flag)
+                elif cancel:
+                    _close(flag)
         _dlg()
 
-def show_delete_component_dialog(conn, comp_id: int):
+def show_delete_component_dialog(comp_id: int):
     flag = f"dlg_del_comp_{comp_id}"
     if st.session_state.get(flag):
         @st.dialog("Delete component")
         def _dlg():
-            st.warning("This deletes the component permanently.", icon="⚠️")
-            c1, c2 = st.columns(2)
-            yes = c1.button("Confirm Delete", type="primary", use_container_width=True, key=f"del_yes_{comp_id}")
-            no = c2.button("Cancel", use_container_width=True, key=f"del_no_{comp_id}")
-            if yes:
-                delete_component(conn, comp_id)
-                st.session_state.builder_list = [cid for cid in st.session_state.builder_list if cid != comp_id]
-                _close(flag)
-            elif no:
-                _close(flag)
+            with borrow_conn() as conn:
+                st.warning("This deletes the component permanently.", icon="⚠️")
+                c1, c2 = st.columns(2)
+                yes = c1.button("Confirm Delete", type="primary", use_container_width=True, key=f"del_yes_{comp_id}")
+                no = c2.button("Cancel", use_container_width=True, key=f"del_no_{comp_id}")
+                if yes:
+                    delete_component(conn, comp_id)
+                    st.session_state.builder_list = [cid for cid in st.session_state.builder_list if cid != comp_id]
+                    _close(flag)
+                elif no:
+                    _close(flag)
         _dlg()
 
 def show_edit_component_dialog(conn, comp_id: int):
     flag = f"dlg_edit_comp_{comp_id}"
     if st.session_state.get(flag):
-        comp = get_component(conn, comp_id)
+        comp = get_component_cached(conn, comp_id)
         title = f"Edit component: {comp['name'] if comp else comp_id}"
         @st.dialog(title)
         def _dlg():
-            if not comp:
-                st.warning("Component no longer exists.")
-                if st.button("Close"):
-                    _close(flag)
-                return
-            with st.form(key=f"edit_component_form_{comp_id}"):
-                new_name = st.text_input("Component name", value=comp["name"])
-                folder_options = all_folders_with_paths(conn)
-                idx = 0
-                for i, (fid, _) in enumerate(folder_options):
-                    if fid == comp["folder_id"]:
-                        idx = i
-                        break
-                dest = st.selectbox("Folder", options=folder_options, index=idx, format_func=lambda x: x[1])
-                content = st.text_area("Content", value=comp["content"], height=350)
-                c1, c2 = st.columns(2)
-                save = c1.form_submit_button("💾 Save", use_container_width=True)
-                cancel = c2.form_submit_button("Cancel", use_container_width=True)
-                if save:
-                    if new_name.strip() != comp["name"]:
-                        rename_component(conn, comp_id, new_name.strip())
-                    if dest[0] != comp["folder_id"]:
-                        move_component(conn, comp_id, dest[0])
-                    if content != comp["content"]:
-                        update_component_content(conn, comp_id, content)
-                    _close(flag)
-                elif cancel:
-                    _close(flag)
+            with borrow_conn() as conn:
+                if not comp:
+                    st.warning("Component no longer exists.")
+                    if st.button("Close"):
+                        _close(flag)
+                    return
+                with st.form(key=f"edit_component_form_{comp_id}"):
+                    new_name = st.text_input("Component name", value=comp["name"])
+                    folder_options = all_folders_with_paths(conn)
+                    idx = 0
+                    for i, (fid, _) in enumerate(folder_options):
+                        if fid == comp["folder_id"]:
+                            idx = i
+                            break
+                    dest = st.selectbox("Folder", options=folder_options, index=idx, format_func=lambda x: x[1])
+                    content = st.text_area("Content", value=comp["content"], height=350)
+                    c1, c2 = st.columns(2)
+                    save = c1.form_submit_button("💾 Save", use_container_width=True)
+                    cancel = c2.form_submit_button("Cancel", use_container_width=True)
+                    if save:
+                        update_component(
+                            conn,
+                            comp_id,
+                            name=new_name.strip() if new_name.strip() != comp["name"] else None,
+                            folder_id=dest[0] if dest[0] != comp["folder_id"] else None,
+                            content=content if content != comp["content"] else None,
+                        )
+                        _close(flag)
+                    elif cancel:
+                        _close(flag)
         _dlg()
 
-def show_import_dialog(conn: sqlite3.Connection):
+def show_import_dialog():
     flag = "dlg_import_json"
     if st.session_state.get(flag):
         @st.dialog("Import JSON backup")
         def _dlg():
-            uploaded = st.file_uploader("Choose a JSON file", type=["json"], accept_multiple_files=False)
-            c1, c2 = st.columns(2)
-            do_load = c1.button("Load", type="primary", use_container_width=True)
-            cancel = c2.button("Cancel", use_container_width=True)
-            if do_load:
-                if not uploaded:
-                    st.warning("Please select a JSON file.")
-                else:
-                    try:
-                        text = uploaded.read().decode("utf-8")
-                        import_db_from_json(conn, text)
-                        # Clear volatile UI state that points at old IDs/content
-                        st.session_state.builder_list = []
-                        st.session_state.free_text = ""
-                        st.success("Import complete.")
-                        st.session_state[flag] = False
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Import failed: {e}")
-            if cancel:
-                st.session_state[flag] = False
-                st.rerun()
+            with borrow_conn() as conn:
+                uploaded = st.file_uploader("Choose a JSON file", type=["json"], accept_multiple_files=False)
+                c1, c2 = st.columns(2)
+                do_load = c1.button("Load", type="primary", use_container_width=True)
+                cancel = c2.button("Cancel", use_container_width=True)
+                if do_load:
+                    if not uploaded:
+                        st.warning("Please select a JSON file.")
+                    else:
+                        try:
+                            text = uploaded.read().decode("utf-8")
+                            import_db_from_json(conn, text)
+                            # Clear volatile UI state that points at old IDs/content
+                            st.session_state.builder_list = []
+                            st.session_state.free_text = ""
+                            st.success("Import complete.")
+                            st.session_state[flag] = False
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Import failed: {e}")
+                if cancel:
+                    st.session_state[flag] = False
+                    st.rerun()
         _dlg()
 
 # -------------------------------
 # UI Helpers
 # -------------------------------
 def add_to_builder(component_id: int):
-    st.session_state.builder_list.append(component_id)
-
-def move_up(idx: int):
-    if idx > 0:
-        L = st.session_state.builder_list
-        L[idx-1], L[idx] = L[idx], L[idx-1]
-
-def move_down(idx: int):
     L = st.session_state.builder_list
-    if idx < len(L)-1:
-        L[idx+1], L[idx] = L[idx], L[idx+1]
-
-def remove_from_builder(idx: int):
-    st.session_state.builder_list.pop(idx)
+    L.append(component_id)
+    if len(L) > MAX_BUILDER_ITEMS:
+        del L[:len(L) - MAX_BUILDER_ITEMS]
+
+def render_builder_order(by_id: Dict[int, sqlite3.Row]):
+    # One drag-and-drop widget for the whole list: reorder in place, or drag into the
+    # second container to remove. Duplicate names get zero-width suffixes (as in _pp_label)
+    # so every label maps back to exactly one builder entry.
+    builder_list = st.session_state.builder_list  # bind once; proxy attribute access is not free
+    labels: List[str] = []
+    id_by_label: Dict[str, int] = {}
+    seen: Dict[str, int] = {}
+    for cid in builder_list:
+        c = by_id.get(cid)
+        if not c:
+            continue
+        base = f"🧩 {c['name']}"
+        label = base + ("\u200b" * seen.get(base, 0))
+        seen[base] = seen.get(base, 0) + 1
+        labels.append(label)
+        id_by_label[label] = cid
+    containers = sort_items(
+        [{"header": "Order", "items": labels}, {"header": "Drop here to remove", "items": []}],
+        multi_containers=True,
+        direction="vertical",
+        key=f"builder_sort_{hash(tuple(builder_list))}",
+    )
+    # No st.rerun() here: the rest of the builder panel reads the new order later in this
+    # same fragment run, and the widget key changes with the list so it remounts next run
+    new_order = [id_by_label[label] for label in containers[0]["items"]]
+    if new_order != builder_list:
+        st.session_state.builder_list = new_order
+
+def copy_prompt_button(text: str):
+    # The button lives inside the component iframe so the click gives the browser the user
+    # activation the Clipboard API needs; the result is reported there too, since the server
+    # cannot tell whether the copy worked. Escaping "<" keeps the prompt from closing the
+    # <script> block or injecting markup.
+    payload = json.dumps(text).replace("<", "\\u003c")
+    components.html(
+        f"""
+        <button id="copy" style="font: inherit; padding: 0.25rem 0.75rem; cursor: pointer;">Copy Prompt</button>
+        <span id="status" style="font-family: sans-serif; font-size: 0.85rem; margin-left: 0.5rem;"></span>
+        <script>
+        const text = {payload};
+        const status = document.getElementById("status");
+        function fallbackCopy() {{
+            const ta = document.createElement("textarea");
+            ta.value = text;
+            document.body.appendChild(ta);
+            ta.select();
+            const ok = document.execCommand("copy");
+            ta.remove();
+            return ok;
+        }}
+        document.getElementById("copy").addEventListener("click", () => {{
+            navigator.clipboard.writeText(text)
+                .then(() => true, () => fallbackCopy())
+                .then((ok) => {{ status.textContent = ok ? "Copied to clipboard." : "Copy failed."; }});
+        }});
+        </script>
+        """,
+        height=45,
+    )
 
 def clear_all():
     st.session_state.builder_list = []
     st.session_state.free_text = ""
 
-def render_component_item(conn: sqlite3.Connection, comp: sqlite3.Row):
+def render_component_item(conn: sqlite3.Connection, comp: dict):
     left, center, right = st.columns([8, 1, 1])
     with left:
         if st.button(f"{comp['name']}", key=f"open_comp_{comp['id']}"):
-            st.session_state[f"dlg_edit_comp_{comp['id']}"] = True
+            _set_dialog_open(f"dlg_edit_comp_{comp['id']}", True)
     with center:
-        st.button("➕", key=f"add_{comp['id']}", on_click=add_to_builder, args=(comp["id"],))
+        # Full rerun so the builder panel outside the tree fragment picks up the change
+        if st.button("➕", key=f"add_{comp['id']}"):
+            add_to_builder(comp["id"])
+            st.rerun()
     with right:
         pp_holder = st.empty()
         with pp_holder.container():
@@ -545,14 +876,31 @@ def render_component_item(conn: sqlite3.Connection, comp: sqlite3.Row):
                     pp_holder.empty()
                     _open_dialog(f"dlg_del_comp_{comp['id']}")
 
-        show_edit_component_dialog(conn, comp["id"])
-        show_rename_component_dialog(conn, comp["id"], comp["name"])
-        show_move_component_dialog(conn, comp["id"], comp["folder_id"])
-        show_delete_component_dialog(conn, comp["id"])
-
-def render_folder_node(conn: sqlite3.Connection, folder: sqlite3.Row, depth: int = 0, home_id: Optional[int] = None):
+        open_dialogs = st.session_state._open_dialogs
+        if open_dialogs:
+            if f"dlg_edit_comp_{comp['id']}" in open_dialogs:
+                show_edit_component_dialog(conn, comp["id"])
+            if f"dlg_rename_comp_{comp['id']}" in open_dialogs:
+                show_rename_component_dialog(comp["id"], comp["name"])
+            if f"dlg_move_comp_{comp['id']}" in open_dialogs:
+                show_move_component_dialog(comp["id"], comp["folder_id"])
+            if f"dlg_del_comp_{comp['id']}" in open_dialogs:
+                show_delete_component_dialog(comp["id"])
+
+def render_folder_node(
+    conn: sqlite3.Connection,
+    folder: dict,
+    depth: int = 0,
+    home_id: Optional[int] = None,
+    folders_by_parent: Optional[Dict[Optional[int], List[dict]]] = None,
+    comps_by_folder: Optional[Dict[int, List[dict]]] = None,
+):
+    if folders_by_parent is None or comps_by_folder is None:
+        folders_by_parent, comps_by_folder = load_folder_tree(conn)
     is_home = home_id is not None and folder["id"] == home_id
-    with st.expander(f"📁 {folder['name']}", expanded=is_home):
+    expanded_folders = st.session_state.expanded_folders
+    loaded = is_home or folder["id"] in expanded_folders
+    with st.expander(f"📁 {folder['name']}", expanded=loaded):
         # Row with a far-right "…" popover (same spot as the old action buttons)
         _, folder_acts = st.columns([9, 1])
         with folder_acts:
@@ -563,17 +911,26 @@ def render_folder_node(conn: sqlite3.Connection, folder: sqlite3.Row, depth: int
                     new_component_clicked = st.button("New component", key=f"nc_btn_{folder['id']}", use_container_width=True)
                     rename_clicked = False
                     delete_clicked = False
+                    collapse_clicked = False
                     if not is_home:
                         rename_clicked = st.button("Rename", key=f"rf_btn_{folder['id']}", use_container_width=True)
                         delete_clicked = st.button("Delete folder", key=f"df_btn_{folder['id']}", use_container_width=True)
+                        if loaded:
+                            collapse_clicked = st.button("Collapse", key=f"cf_btn_{folder['id']}", use_container_width=True)
 
                     # Close the popover BEFORE opening any dialog (so it can't linger)
                     if new_folder_clicked:
                         pp_holder.empty()
+                        expanded_folders.add(folder["id"])  # so the new subfolder is visible
                         _open_dialog(f"dlg_new_folder_{folder['id']}")
                     if new_component_clicked:
                         pp_holder.empty()
+                        expanded_folders.add(folder["id"])
                         _open_dialog(f"dlg_new_comp_{folder['id']}")
+                    if collapse_clicked:
+                        pp_holder.empty()
+                        expanded_folders.discard(folder["id"])
+                        st.rerun()
                     if rename_clicked:
                         pp_holder.empty()
                         _open_dialog(f"dlg_rename_folder_{folder['id']}")
@@ -581,15 +938,29 @@ def render_folder_node(conn: sqlite3.Connection, folder: sqlite3.Row, depth: int
                         pp_holder.empty()
                         _open_dialog(f"dlg_del_folder_{folder['id']}")
 
-        # Render dialogs (unchanged)
-        show_new_folder_dialog(conn, folder["id"])
-        show_new_component_dialog(conn, folder["id"])
-        if not is_home:
-            show_rename_folder_dialog(conn, folder["id"], folder["name"])
-            show_delete_folder_dialog(conn, folder["id"], folder["name"])
+        # Render dialogs only when one of this folder's flags is set
+        open_dialogs = st.session_state._open_dialogs
+        if open_dialogs:
+            if f"dlg_new_folder_{folder['id']}" in open_dialogs:
+                show_new_folder_dialog(folder["id"])
+            if f"dlg_new_comp_{folder['id']}" in open_dialogs:
+                show_new_component_dialog(folder["id"])
+            if not is_home:
+                if f"dlg_rename_folder_{folder['id']}" in open_dialogs:
+                    show_rename_folder_dialog(folder["id"], folder["name"])
+                if f"dlg_del_folder_{folder['id']}" in open_dialogs:
+                    show_delete_folder_dialog(folder["id"], folder["name"])
+
+        # Collapsed subtrees render nothing below the actions row until loaded, so
+        # render work scales with what the user has opened rather than the whole tree
+        if not loaded:
+            if st.button("Show contents", key=f"expand_{folder['id']}"):
+                expanded_folders.add(folder["id"])
+            else:
+                return
 
         # Components in this folder
-        comps = list_components_by_folder(conn, folder["id"])
+        comps = comps_by_folder.get(folder["id"], [])
         if comps:
             st.markdown("**Components**")
             for c in comps:
@@ -598,116 +969,144 @@ def render_folder_node(conn: sqlite3.Connection, folder: sqlite3.Row, depth: int
             st.caption("No components here yet.")
 
         # Subfolders
-        children = list_folders_by_parent(conn, folder["id"])
+        children = folders_by_parent.get(folder["id"], [])
         if children:
             st.markdown("**Subfolders**")
             for child in children:
-                render_folder_node(conn, child, depth=depth + 1, home_id=home_id)
+                render_folder_node(
+                    conn, child, depth=depth + 1, home_id=home_id,
+                    folders_by_parent=folders_by_parent, comps_by_folder=comps_by_folder,
+                )
 
 def render_root_tree(conn: sqlite3.Connection):
     home_id = get_home_folder_id(conn)
-    home = get_folder(conn, home_id)
-    render_folder_node(conn, home, depth=0, home_id=home_id)
-
-def build_prompt_text(conn: sqlite3.Connection) -> str:
-    parts: List[str] = []
-    for cid in st.session_state.builder_list:
-        c = get_component(conn, cid)
-        if c:
-            parts.append(c["content"])
-    free = st.session_state.free_text.strip()
-    if free:
-        parts.append(free)
-    return "\n\n".join(parts)
-
-# -------------------------------
-# Sidebar "pages"
-# -------------------------------
-conn = get_conn()
-page = st.sidebar.radio("Pages", options=["Build", "Preview", "Export/Import"], index=0)
-
-# -------------------------------
-# Page: Build (left tree + right builder)
-# -------------------------------
-if page == "Build":
-    left, right = st.columns([5, 7], gap="large")
-
-    with left:
-        st.subheader("Folders & Components")
-        render_root_tree(conn)
+    home = dict(get_folder(conn, home_id))
+    folders_by_parent, comps_by_folder = load_folder_tree(conn)
+    render_folder_node(
+        conn, home, depth=0, home_id=home_id,
+        folders_by_parent=folders_by_parent, comps_by_folder=comps_by_folder,
+    )
 
-    with right:
+def render_picker_tree(conn: sqlite3.Connection):
+    # Read-only "Quick add" view: no expanders, columns, or popovers, just one
+    # markdown line per folder and one add button per component
+    home_id = get_home_folder_id(conn)
+    folders_by_parent, comps_by_folder = load_folder_tree(conn)
+    stack: List[Tuple[int, str, int]] = [(home_id, "home", 0)]
+    while stack:
+        fid, name, depth = stack.pop()
+        indent = "\u2003" * depth
+        st.markdown(f"{indent}📁 **{name}**")
+        for c in comps_by_folder.get(fid, []):
+            if st.button(f"{indent}\u2003➕ {c['name']}", key=f"pick_{c['id']}"):
+                add_to_builder(c["id"])
+                st.rerun()
+        for child in reversed(folders_by_parent.get(fid, [])):
+            stack.append((child["id"], child["name"], depth + 1))
+
+@st.fragment
+def render_tree_panel():
+    # Interactions that only touch the tree (switching views, opening an editor) rerun
+    # just this fragment; actions that affect the builder call st.rerun() for the page.
+    # The connection is borrowed here because fragment reruns skip the page-level borrow.
+    with borrow_conn() as conn:
+        tree_view = st.radio("View", options=["Manage", "Quick add"], horizontal=True, label_visibility="collapsed", key="tree_view")
+        if tree_view == "Quick add":
+            render_picker_tree(conn)
+        else:
+            render_root_tree(conn)
+
+@st.fragment
+def render_builder_panel():
+    # Reordering, editing the free text, and copying rerun only this panel, so the
+    # folder tree is not re-rendered for builder-only changes. Like render_tree_panel,
+    # it borrows its own connection because fragment reruns skip the page-level borrow.
+    with borrow_conn() as conn:
         st.subheader("Prompt Builder")
+        by_id = get_components_by_ids(conn, st.session_state.builder_list)
+        # Drop ids whose components were deleted (e.g. from another session)
+        st.session_state.builder_list = [cid for cid in st.session_state.builder_list if cid in by_id]
         if not st.session_state.builder_list:
             st.info("Add components from the left column to start building your prompt.")
         else:
             st.markdown("**Order & Manage Components**")
-            for i, cid in enumerate(st.session_state.builder_list):
-                c = get_component(conn, cid)
-                if not c:
-                    continue
-                row = st.columns([6, 1, 1, 1])
-                with row[0]:
-                    st.write(f"🧩 {c['name']}")
-                with row[1]:
-                    st.button("↑", key=f"up_{i}", on_click=move_up, args=(i,))
-                with row[2]:
-                    st.button("↓", key=f"down_{i}", on_click=move_down, args=(i,))
-                with row[3]:
-                    st.button("✖", key=f"rem_{i}", on_click=remove_from_builder, args=(i,))
+            render_builder_order(by_id)
 
         st.markdown("**Additional Text (appended to the end)**")
         st.session_state.free_text = st.text_area(" ", value=st.session_state.free_text, label_visibility="collapsed", height=180)
 
-        prompt_text = build_prompt_text(conn)
+        prompt_text = build_prompt_text(conn, by_id)
         c1, c2, c3 = st.columns(3)
         with c1:
             if st.button("Clear All"):
                 clear_all()
                 st.rerun()
         with c2:
-            if st.button("Copy Prompt"):
-                try:
-                    pyperclip.copy(prompt_text)
-                    st.success("Copied to clipboard.")
-                except Exception as e:
-                    st.warning(f"Copy failed: {e}")
+            copy_prompt_button(prompt_text)
         with c3:
             st.download_button("Download Prompt", data=prompt_text, file_name="prompt.txt", mime="text/plain")
 
+def build_prompt_text(conn: sqlite3.Connection, by_id: Optional[Dict[int, sqlite3.Row]] = None) -> str:
+    builder_list = st.session_state.builder_list
+    if by_id is None:
+        by_id = get_components_by_ids(conn, builder_list)
+    parts: List[str] = []
+    ids = tuple(cid for cid in builder_list if cid in by_id)
+    if ids:
+        parts.append(_assemble_components(conn, ids, _components_rev()["rev"]))
+    free = st.session_state.free_text.strip()
+    if free:
+        parts.append(free)
+    return "\n\n".join(parts)
+
 # -------------------------------
-# Page: Preview (full prompt only)
+# Sidebar "pages"
 # -------------------------------
-elif page == "Preview":
-    st.subheader("Full Prompt Preview")
-    prompt_text = build_prompt_text(conn)
-    st.text_area(" ", value=prompt_text, height=550, label_visibility="collapsed", disabled=True)
-    c1, c2 = st.columns(2)
-    with c1:
-        if st.button("Copy Prompt"):
-            try:
-                pyperclip.copy(prompt_text)
-                st.success("Copied to clipboard.")
-            except Exception as e:
-                st.warning(f"Copy failed: {e}")
-    with c2:
-        st.download_button("Download Prompt", data=prompt_text, file_name="prompt.txt", mime="text/plain")
-
-elif page == "Export/Import":
-    st.subheader("Export / Import")
-
-    # Export button: downloads a full JSON snapshot of folders + components
-    json_text = export_db_to_json(conn)
-    st.download_button(
-        "Export",
-        data=json_text,
-        file_name="prompt_components.json",
-        mime="application/json",
-        use_container_width=False
-    )
-    # Load button: opens a dialog with a file uploader
-    if st.button("Load", type="primary", use_container_width=False):
-        st.session_state["dlg_import_json"] = True
+page = st.sidebar.radio("Pages", options=["Build", "Preview", "Export/Import"], index=0)
+
+# Each script run holds one pooled connection for its reads and writes
+with borrow_conn() as conn:
+    # -------------------------------
+    # Page: Build (left tree + right builder)
+    # -------------------------------
+    if page == "Build":
+        left, right = st.columns([5, 7], gap="large")
+
+        with left:
+            st.subheader("Folders & Components")
+            render_tree_panel()
+
+        with right:
+            render_builder_panel()
+
+    # -------------------------------
+    # Page: Preview (full prompt only)
+    # -------------------------------
+    elif page == "Preview":
+        st.subheader("Full Prompt Preview")
+        prompt_text = build_prompt_text(conn)
+        st.text_area(" ", value=prompt_text, height=550, label_visibility="collapsed", disabled=True)
+        c1, c2 = st.columns(2)
+        with c1:
+            copy_prompt_button(prompt_text)
+        with c2:
+            st.download_button("Download Prompt", data=prompt_text, file_name="prompt.txt", mime="text/plain")
 
-    # Render the import dialog when triggered
-    show_import_dialog(conn)
+    elif page == "Export/Import":
+        st.subheader("Export / Import")
+
+        # Export button: downloads a full JSON snapshot of folders + components
+        json_text = export_db_to_json(conn)
+        st.download_button(
+            "Export",
+            data=json_text,
+            file_name="prompt_components.json",
+            mime="application/json",
+            use_container_width=False
+        )
+        # Load button: opens a dialog with a file uploader
+        if st.button("Load", type="primary", use_container_width=False):
+            st.session_state["dlg_import_json"] = True
+
+        # Render the import dialog when triggered
+        show_import_dialog()